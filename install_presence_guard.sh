@@ -8,6 +8,8 @@ FACE_DIR="$HOME/.face_enroll"
 SCRIPT_DIR="$HOME/.local/bin"
 SCRIPT_PATH="$SCRIPT_DIR/presence_guard.py"
 SERVICE_NAME="presence-guard@$USERNAME.service"
+MODEL_DIR="$HOME/.local/share/presence_guard"
+YUNET_URL="https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/face_detection_yunet_2023mar_int8.onnx"
 
 echo "=================================="
 echo "Presence Guard Installation Script"
@@ -30,11 +32,12 @@ sudo apt install -y python3-pip python3-dev cmake build-essential \
     libv4l-dev libxvidcore-dev libx264-dev libjpeg-dev \
     libpng-dev libtiff-dev gfortran openexr libatlas-base-dev \
     python3-numpy libtbb2 libtbb-dev libdc1394-22-dev \
+    python3-dbus \
     acl  # For advanced file permissions
 
 echo ""
 echo "2. Installing Python packages..."
-pip3 install --user opencv-python numpy face_recognition
+pip3 install --user opencv-python numpy face_recognition numba
 
 echo ""
 echo "3. Setting up directories and permissions..."
@@ -56,6 +59,11 @@ fi
 cp "presence_guard.py" "$SCRIPT_PATH"
 chmod 755 "$SCRIPT_PATH"
 
+# YuNet face detector model (falls back to HOG if the download fails)
+mkdir -p "$MODEL_DIR"
+wget -q -O "$MODEL_DIR/face_detection_yunet_2023mar_int8.onnx" "$YUNET_URL" \
+    || echo "Warning: could not download YuNet model; HOG detector will be used."
+
 echo ""
 echo "5. Installing systemd service..."
 # Create systemd user service
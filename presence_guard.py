@@ -2,21 +2,34 @@
 """
 presence_guard.py (fast version)
 - Locks the session unless EXACTLY ONE authorized face is present.
-- Faster detection: small resolution, buffer flush, HOG+upsample, optional CNN fallback.
+- Faster detection: YuNet ONNX detector (OpenCV), HOG+upsample / CNN fallback.
 - Does NOT attempt to unlock (use PAM methods like Howdy/fingerprint).
 """
 
-import os, sys, time, glob, subprocess
+import os, sys, time, glob, queue, atexit, hashlib, subprocess, threading
 from datetime import datetime, timedelta
 import numpy as np
 import cv2
+import dlib
 import face_recognition
 
+try:
+    import numba
+except ImportError:  # optional: falls back to the BLAS dot-product path
+    numba = None
+
+try:
+    import dbus
+except ImportError:  # optional: falls back to lock commands
+    dbus = None
+
 # ===== CONFIG (tune as needed) =====
 ENROLL_DIR = os.path.expanduser("~/.face_enroll")
+ENROLL_CACHE = os.path.join(ENROLL_DIR, ".encodings.npz")  # skip re-encoding unchanged photos
+ENROLL_BATCH_SIZE = 16        # enrollment images per batched CNN pass (CUDA dlib only)
 ALLOWED_TOLERANCE = 0.65      # lower = stricter match
-CHECK_INTERVAL = 0.35         # seconds between checks (fast)
-LOCK_COOLDOWN = 4             # seconds to wait after locking before re-checking
+CHECK_INTERVAL = 0.35         # minimum seconds between checks; otherwise paced by frame arrival
+LOCK_COOLDOWN = 4             # seconds after a lock before another lock is issued (detection keeps running)
 ABSENCE_TIMEOUT = 6           # if 0 faces for this long -> lock (seconds)
 USE_BLUETOOTH = False         # optional 2nd factor
 PHONE_MAC = "AA:BB:CC:11:22:33"
@@ -24,21 +37,103 @@ PHONE_MAC = "AA:BB:CC:11:22:33"
 VIDEO_DEVICE = None           # None = auto-detect 0..3 ; or set to an int like 0
 FRAME_WIDTH = 640             # 640x480 is a good speed/accuracy balance
 FRAME_HEIGHT = 480
+CAMERA_FPS = 30               # requested capture rate (MJPG makes 30 FPS at 640x480 possible over USB)
+MIN_FACE_SIZE = 80            # ignore faces smaller than this (px, full frame); encodings are unreliable
+DETECT_SCALE = 2              # detect on a frame downscaled by this factor (1 = full size)
 HOG_UPSAMPLE = 1              # 0..2 ; higher = more recall, slower
-USE_CNN_FALLBACK = True       # try 'cnn' first if HOG finds nothing (slower but robust)
+USE_CNN_FALLBACK = True       # try 'cnn' if HOG finds nothing (CUDA dlib only; seconds/frame on CPU)
+USE_YUNET = True              # OpenCV YuNet ONNX detector; False = HOG (+CNN fallback)
+YUNET_MODEL = os.path.expanduser("~/.local/share/presence_guard/face_detection_yunet_2023mar_int8.onnx")
+YUNET_SCORE = 0.6             # YuNet confidence threshold
 ENCODING_EVERY_N = 1          # run face-ID every N frames (speed boost)
+PREFILTER_DIMS = 16           # with many enrollment photos, rule out rows on these dims first
+PREFILTER_MIN_ROWS = 10       # ...only once there are more than this many
+REUSE_IOU = 0.7               # skip re-encoding if the face box overlaps the last verified one this much
+REVERIFY_SECONDS = 3.0        # ...but always re-verify identity at least this often
+REQUIRE_SIMD_DLIB = True      # refuse to run on a dlib built without AVX/NEON (5-10x slower)
 LOGFILE = os.path.expanduser("~/presence_guard.log")
+LOG_FLUSH_INTERVAL = 0.25     # seconds of log lines batched into one file write
 # ===================================
 
+_HAS_CUDA = bool(getattr(dlib, "DLIB_USE_CUDA", False))
+_cnn_detector = None          # dlib CNN model when usable, see init_cnn_detector()
+_yunet = None                 # persistent YuNet detector, see init_yunet()
+_dbus_lock = None             # logind Session.Lock method, see init_dbus_lock()
+_next_lock_ok = datetime.min  # lock_with_cooldown() is silent until this time
+_lock_suppressed_logged = False
+_bt_present = True            # cached is_phone_present() result, see phone_present_cached()
+_bt_checked_at = datetime.min
+
+# dlib models called directly (no face_recognition wrapper in the hot path); these
+# are the single instances face_recognition.api already built at import
+_ENCODING_MODEL = "resnet_v1/5pt"   # part of the enrollment cache key; change if the encoder does
+_hog_detector = face_recognition.api.face_detector
+_shape_predictor = face_recognition.api.pose_predictor_5_point
+_face_encoder = face_recognition.api.face_encoder
+
+# check_presence() state: reused RGB buffer and last verified face (temporal caching)
+_rgb_buf = None
+_last_auth_box = None
+_last_auth_time = None
+
+# Log file writes happen on a background thread so disk latency never stalls the loop
+_log_q = queue.Queue(maxsize=1024)
+_log_stop = threading.Event()
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+def _write_lines(lines):
+    try:
+        with open(LOGFILE, "a") as f:
+            f.writelines(lines)
+    except Exception:
+        pass
+
+def _drain_log_queue():
+    lines = []
+    while True:
+        try:
+            lines.append(_log_q.get_nowait())
+        except queue.Empty:
+            break
+    if lines:
+        _write_lines(lines)
+
+def _log_drain():
+    while not _log_stop.wait(LOG_FLUSH_INTERVAL):
+        _drain_log_queue()
+
+def _stop_log_writer():
+    _log_stop.set()
+    _log_writer.join(timeout=2)
+    _drain_log_queue()
+
+def _start_log_writer():
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None:
+            _log_writer = threading.Thread(target=_log_drain, daemon=True)
+            _log_writer.start()
+            atexit.register(_stop_log_writer)
+
 def log(msg):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"{ts} - {msg}"
     print(line, flush=True)
+    if _log_writer is None:
+        _start_log_writer()
     try:
-        with open(LOGFILE, "a") as f:
-            f.write(line + "\n")
-    except Exception:
-        pass
+        _log_q.put_nowait(line + "\n")
+    except queue.Full:
+        # drop the oldest line rather than block the detection loop
+        try:
+            _log_q.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            _log_q.put_nowait(line + "\n")
+        except queue.Full:
+            pass
 
 def is_phone_present(mac):
     try:
@@ -50,7 +145,50 @@ def is_phone_present(mac):
         log(f"bluetooth check error: {e}")
         return False
 
+def phone_present_cached(mac):
+    """is_phone_present(), re-run at most once per LOCK_COOLDOWN seconds."""
+    global _bt_present, _bt_checked_at
+    now = datetime.now()
+    if (now - _bt_checked_at).total_seconds() >= LOCK_COOLDOWN:
+        _bt_present = is_phone_present(mac)
+        _bt_checked_at = now
+    return _bt_present
+
+def init_dbus_lock():
+    """Bind logind's Session.Lock once so locking needs no fork/exec."""
+    global _dbus_lock
+    if dbus is None:
+        log("python dbus not installed; locking via external commands.")
+        return
+    try:
+        bus = dbus.SystemBus()
+    except Exception as e:
+        log(f"Cannot connect to system D-Bus ({e}); locking via external commands.")
+        return
+    # "auto" also resolves for user services outside a session (logind >= 243)
+    for path in ("/org/freedesktop/login1/session/auto",
+                 "/org/freedesktop/login1/session/self"):
+        try:
+            session = bus.get_object("org.freedesktop.login1", path)
+            # resolve now so a bad path fails here rather than at lock time
+            session.Get("org.freedesktop.login1.Session", "Id",
+                        dbus_interface="org.freedesktop.DBus.Properties", timeout=5)
+        except Exception:
+            continue
+        _dbus_lock = session.get_dbus_method("Lock", "org.freedesktop.login1.Session")
+        log(f"Locking via D-Bus {path}")
+        return
+    log("No logind session found on D-Bus; locking via external commands.")
+
 def lock_session():
+    if _dbus_lock is not None:
+        try:
+            # same cap as each lock command below (libdbus would default to 25 s)
+            _dbus_lock(timeout=5)
+            log("Locked via: logind D-Bus")
+            return True
+        except Exception as e:
+            log(f"D-Bus lock failed: {e}")
     cmds = [
         ["loginctl", "lock-sessions"],
         ["gnome-screensaver-command", "--lock"],
@@ -67,66 +205,431 @@ def lock_session():
     log("All lock commands failed.")
     return False
 
+def lock_with_cooldown(reason):
+    """Lock unless a lock was issued within the last LOCK_COOLDOWN seconds."""
+    global _next_lock_ok, _lock_suppressed_logged
+    now = datetime.now()
+    if now < _next_lock_ok:
+        if not _lock_suppressed_logged:
+            log(f"{reason}; lock suppressed (cooldown)")
+            _lock_suppressed_logged = True
+        return False
+    _next_lock_ok = now + timedelta(seconds=LOCK_COOLDOWN)
+    _lock_suppressed_logged = False
+    log(f"{reason} -> locking")
+    return lock_session()
+
 def open_camera():
     """Open specific device or auto-detect 0..3. Set size and small buffer."""
     indices = [VIDEO_DEVICE] if isinstance(VIDEO_DEVICE, int) else [0,1,2,3]
     for idx in indices:
         cap = cv2.VideoCapture(idx, cv2.CAP_V4L2)
         if cap.isOpened():
+            # MJPG avoids the low frame rates many UVC cameras have with raw YUYV
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+            cap.set(cv2.CAP_PROP_FPS, CAMERA_FPS)
             # set resolution + try to reduce buffering/latency
             cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
             cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
             cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-            # warmup: read a few frames
-            for _ in range(8):
+            # warmup: MJPG streams settle almost immediately
+            for _ in range(2):
                 cap.read()
+            fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+            fourcc_str = "".join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4))
+            log(f"Camera format {fourcc_str!r} at {cap.get(cv2.CAP_PROP_FPS):.0f} FPS")
             return cap, idx
         if cap:
             cap.release()
     return None, None
 
-def latest_frame(cap):
-    """Flush stale frames then retrieve the freshest."""
-    # some drivers honor grab()+retrieve() for fresher frames
-    for _ in range(3):
-        cap.grab()
-    ok, f = cap.retrieve()
-    if not ok:
-        ok, f = cap.read()
-    return f if ok else None
-
-def load_known_encodings(enroll_dir):
-    files = [p for p in glob.glob(os.path.join(enroll_dir, "*")) if os.path.isfile(p)]
-    encodings = []
+# Single-slot frame buffer filled by the grabber thread; _frame_seq counts frames
+_frame_cond = threading.Condition()
+_latest = None
+_frame_seq = 0
+_grab_stop = threading.Event()
+
+def grabber(cap):
+    """Continuously read frames so capture overlaps with detection.
+
+    The thread owns cap and releases it on exit, so release never races a read.
+    """
+    global _latest, _frame_seq
+    try:
+        while not _grab_stop.is_set():
+            ok, f = cap.read()
+            if not ok:
+                f = None
+                time.sleep(0.05)
+            with _frame_cond:
+                _latest = f
+                _frame_seq += 1
+                _frame_cond.notify_all()
+    finally:
+        cap.release()
+
+def start_grabber(cap):
+    _grab_stop.clear()
+    t = threading.Thread(target=grabber, args=(cap,), daemon=True)
+    t.start()
+    return t
+
+def stop_grabber(t):
+    _grab_stop.set()
+    t.join(timeout=2)
+    if t.is_alive():
+        log("Camera thread still blocked in read; leaving it to exit with the process")
+
+def latest_frame(after_seq=0, timeout=1.0):
+    """Block until a frame newer than after_seq arrives; return (frame copy, seq).
+
+    The frame is None if the camera is failing or nothing arrived within timeout.
+    """
+    with _frame_cond:
+        if not _frame_cond.wait_for(lambda: _frame_seq > after_seq, timeout=timeout):
+            return None, after_seq
+        f = None if _latest is None else _latest.copy()
+        return f, _frame_seq
+
+def stat_enrollment_files(files):
+    """Sorted (name, mtime, size) per file; files removed since the glob are skipped."""
+    entries = []
+    for f in files:
+        try:
+            st = os.stat(f)
+        except OSError as e:
+            log(f"Skipping enroll image {f}: {e}")
+            continue
+        entries.append((f, st.st_mtime, st.st_size))
+    return sorted(entries)
+
+def enrollment_key(entries):
+    """Hash of the enrollment listing (name, mtime, size) and encoder used to validate the cache."""
+    return hashlib.sha1(repr((_ENCODING_MODEL, entries)).encode()).hexdigest()
+
+def load_cached_encodings(cache_file, key):
+    try:
+        with np.load(cache_file) as data:
+            if str(data["key"]) == key:
+                return np.ascontiguousarray(data["enc"], dtype=np.float32)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log(f"Ignoring unreadable encoding cache {cache_file}: {e}")
+    return None
+
+def save_cached_encodings(cache_file, key, known):
+    tmp = cache_file + ".tmp"
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, key=key, enc=known)
+        os.replace(tmp, cache_file)
+    except Exception as e:
+        log(f"Could not write encoding cache {cache_file}: {e}")
+
+def load_known_encodings(enroll_dir, cache_file=ENROLL_CACHE):
+    entries = stat_enrollment_files(
+        p for p in glob.glob(os.path.join(enroll_dir, "*")) if os.path.isfile(p)
+    )
+    files = [f for f, _, _ in entries]
+    key = enrollment_key(entries)
+    known = load_cached_encodings(cache_file, key)
+    if known is not None:
+        log(f"Loaded {len(known)} enrollment encodings from cache")
+        return known
+    known = encode_enrollment_files(files)
+    if known is not None:
+        save_cached_encodings(cache_file, key, known)
+    return known
+
+def locate_enrollment_faces(files):
+    """Yield (file, image, locations) using HOG, one image at a time."""
     for f in files:
         try:
             img = face_recognition.load_image_file(f)
             # detect with HOG for enrollment (fast)
             locs = face_recognition.face_locations(img, number_of_times_to_upsample=1, model="hog")
-            if not locs:
-                log(f"No face found in enroll image: {f}")
+        except Exception as e:
+            log(f"Error loading {f}: {e}")
+            continue
+        yield f, img, locs
+
+def locate_enrollment_faces_batched(files):
+    """Yield (file, image, locations) using batched CNN detection on CUDA.
+
+    dlib batches only same-sized images, so photos are grouped by shape.
+    """
+    by_shape = {}
+    for f in files:
+        try:
+            img = face_recognition.load_image_file(f)
+        except Exception as e:
+            log(f"Error loading {f}: {e}")
+            continue
+        by_shape.setdefault(img.shape, []).append((f, img))
+    for group in by_shape.values():
+        for i in range(0, len(group), ENROLL_BATCH_SIZE):
+            chunk = group[i:i + ENROLL_BATCH_SIZE]
+            imgs = [img for _, img in chunk]
+            try:
+                batch_locs = face_recognition.batch_face_locations(
+                    imgs, number_of_times_to_upsample=0, batch_size=len(imgs)
+                )
+            except Exception as e:
+                log(f"Batched face detection failed ({e}); falling back to HOG")
+                yield from locate_enrollment_faces([f for f, _ in chunk])
                 continue
-            enc = face_recognition.face_encodings(img, known_face_locations=locs)
-            if enc:
-                encodings.append(enc[0])
-                log(f"Loaded enrollment face from {os.path.basename(f)}")
+            for (f, img), locs in zip(chunk, batch_locs):
+                yield f, img, locs
+
+def encode_enrollment_files(files):
+    located = (locate_enrollment_faces_batched(files) if _HAS_CUDA
+               else locate_enrollment_faces(files))
+    encodings = []
+    for f, img, locs in located:
+        if not locs:
+            log(f"No face found in enroll image: {f}")
+            continue
+        try:
+            encodings.append(encode_face(img, locs[0]))
+            log(f"Loaded enrollment face from {os.path.basename(f)}")
         except Exception as e:
             log(f"Error loading {f}: {e}")
-    return np.array(encodings) if encodings else None
+    if not encodings:
+        return None
+    return np.ascontiguousarray(np.stack(encodings), dtype=np.float32)
+
+def normalize_encodings(known):
+    """L2-normalize float32 enrollment rows into a contiguous float32 matrix."""
+    known_n = known / np.linalg.norm(known, axis=1, keepdims=True)
+    return np.ascontiguousarray(known_n, dtype=np.float32)
+
+def _sq_dists_py(known, q):
+    """Squared euclidean distance from q to every row of known (no temporaries)."""
+    out = np.empty(known.shape[0], np.float32)
+    for i in range(known.shape[0]):
+        s = 0.0
+        for j in range(known.shape[1]):
+            d = known[i, j] - q[j]
+            s += d * d
+        out[i] = s
+    return out
+
+def _compile_sq_dists():
+    """JIT the distance kernel; None if numba is missing or compilation fails.
+
+    The on-disk cache needs a writable __pycache__ or ~/.cache, which the
+    hardened service (ProtectHome=read-only) doesn't have, so retry uncached.
+    """
+    if numba is None:
+        return None
+    for cache in (True, False):
+        try:
+            return numba.njit("f4[::1](f4[:, ::1], f4[::1])",
+                              fastmath=True, cache=cache)(_sq_dists_py)
+        except Exception:
+            continue
+    return None
+
+sq_dists = _compile_sq_dists()
+
+def prefilter_head(known_n):
+    """Contiguous copy of the first PREFILTER_DIMS columns, or None if too few rows."""
+    if len(known_n) <= PREFILTER_MIN_ROWS:
+        return None
+    return np.ascontiguousarray(known_n[:, :PREFILTER_DIMS])
+
+def best_distance(known_n, enc, known_head=None):
+    """Smallest euclidean distance between enc and the normalized enrollment rows.
+
+    Uses the Numba kernel when available; otherwise, for unit vectors
+    |a - b|^2 = 2 - 2 a.b, so one gemv replaces the (N,128) subtract.
+    With known_head, rows whose partial distance over the leading dims already
+    exceeds ALLOWED_TOLERANCE are skipped (partial distance <= full distance);
+    if none survive, inf is returned since no real distance was computed.
+    """
+    q = np.array(enc, dtype=np.float32)
+    q /= np.linalg.norm(q)
+    if known_head is not None:
+        head = np.linalg.norm(known_head - q[:known_head.shape[1]], axis=1)
+        cand = np.flatnonzero(head <= ALLOWED_TOLERANCE)
+        if cand.size == 0:
+            # every row is already out of tolerance
+            return float("inf")
+        known_n = np.ascontiguousarray(known_n[cand])
+    if sq_dists is not None:
+        return float(np.sqrt(sq_dists(known_n, q).min()))
+    sims = known_n @ q
+    return float(np.sqrt(max(0.0, 2.0 - 2.0 * float(sims.max()))))
+
+def init_yunet():
+    """Load the YuNet detector once; left unset if unavailable (falls back to HOG)."""
+    global _yunet
+    if not USE_YUNET:
+        return
+    if not hasattr(cv2, "FaceDetectorYN"):
+        log("cv2.FaceDetectorYN not available (need OpenCV >= 4.5.4); using HOG.")
+        return
+    if not os.path.isfile(YUNET_MODEL):
+        log(f"YuNet model {YUNET_MODEL} not found; using HOG.")
+        return
+    try:
+        _yunet = cv2.FaceDetectorYN.create(
+            YUNET_MODEL, "", (FRAME_WIDTH // DETECT_SCALE, FRAME_HEIGHT // DETECT_SCALE),
+            score_threshold=YUNET_SCORE
+        )
+    except Exception as e:
+        log(f"Failed to load YuNet model: {e}; using HOG.")
+
+def detect_faces(bgr, rgb):
+    """Return face locations as (top, right, bottom, left) tuples.
+
+    Uses YuNet on the BGR frame when available, else HOG on the RGB frame;
+    only the frame the active detector needs has to be given.
+    """
+    if _yunet is not None:
+        h, w = bgr.shape[:2]
+        _yunet.setInputSize((w, h))
+        _, faces = _yunet.detect(bgr)
+        if faces is None:
+            return []
+        locs = []
+        for x, y, fw, fh in faces[:, :4].astype(int):
+            locs.append((max(y, 0), min(x + fw, w), min(y + fh, h), max(x, 0)))
+        return locs
+    return detect_faces_rgb(rgb)
+
+def detect_faces_scaled(bgr, rgb):
+    """Detect on a downscaled copy and map boxes back to full-frame coordinates."""
+    if DETECT_SCALE <= 1:
+        return detect_faces(bgr, rgb)
+    h, w = bgr.shape[:2]
+    size = (w // DETECT_SCALE, h // DETECT_SCALE)
+    # only the active detector's input is resized: YuNet takes BGR, HOG/CNN take RGB
+    if _yunet is not None:
+        small_bgr = cv2.resize(bgr, size, interpolation=cv2.INTER_AREA)
+        small_rgb = None
+    else:
+        small_bgr = None
+        small_rgb = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+    k = DETECT_SCALE
+    return [(t * k, r * k, b * k, l * k)
+            for t, r, b, l in detect_faces(small_bgr, small_rgb)]
+
+def init_cnn_detector():
+    """Enable the CNN fallback, but only in HOG mode and when dlib can run it on CUDA.
+
+    Call after init_yunet(): with YuNet active the HOG/CNN path never runs.
+    """
+    global _cnn_detector
+    if not USE_CNN_FALLBACK or _yunet is not None:
+        return
+    if not _HAS_CUDA:
+        log("dlib has no CUDA support; disabling CNN fallback (it would stall for seconds per frame).")
+        return
+    _cnn_detector = face_recognition.api.cnn_face_detector
+    log("CNN fallback enabled on CUDA (HOG mode)")
+
+def rect_to_css(rect, shape):
+    """dlib rectangle -> (top, right, bottom, left) clipped to the image."""
+    h, w = shape[:2]
+    return (max(rect.top(), 0), min(rect.right(), w), min(rect.bottom(), h), max(rect.left(), 0))
 
 def detect_faces_rgb(rgb):
     """Return face locations using fast HOG; optional CNN fallback."""
-    locs = face_recognition.face_locations(
-        rgb, number_of_times_to_upsample=HOG_UPSAMPLE, model="hog"
-    )
-    if not locs and USE_CNN_FALLBACK:
+    locs = [rect_to_css(r, rgb.shape) for r in _hog_detector(rgb, HOG_UPSAMPLE)]
+    if not locs and _cnn_detector is not None:
         # One pass of CNN with mild upsample for hard angles/low light
-        locs = face_recognition.face_locations(
-            rgb, number_of_times_to_upsample=1, model="cnn"
-        )
+        locs = [rect_to_css(d.rect, rgb.shape) for d in _cnn_detector(rgb, 1)]
     return locs
 
+def encode_face(rgb, box):
+    """128-D float32 descriptor for the face at (top, right, bottom, left)."""
+    t, r, b, l = box
+    shape = _shape_predictor(rgb, dlib.rectangle(l, t, r, b))
+    return np.array(_face_encoder.compute_face_descriptor(rgb, shape), dtype=np.float32)
+
+def box_iou(a, b):
+    """Intersection-over-union of two (top, right, bottom, left) boxes."""
+    ih = min(a[2], b[2]) - max(a[0], b[0])
+    iw = min(a[1], b[1]) - max(a[3], b[3])
+    if ih <= 0 or iw <= 0:
+        return 0.0
+    inter = ih * iw
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+def forget_verified_face():
+    """Drop the temporal-cache box so the next single face is re-encoded."""
+    global _last_auth_box
+    _last_auth_box = None
+
+def check_presence(frame, known_n, verify=True, known_head=None):
+    """Detect faces in a BGR frame and verify identity when exactly one is present.
+
+    Returns (n_faces, authorized). With verify=False the encoder is skipped and
+    a single face only counts as authorized if it matches the last verified box.
+    """
+    global _rgb_buf, _last_auth_box, _last_auth_time
+    # BGR -> RGB into a reused contiguous buffer; detection downscales, encoding uses full size
+    if _rgb_buf is None or _rgb_buf.shape != frame.shape:
+        _rgb_buf = np.empty_like(frame)
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=_rgb_buf)
+    # Fast face count
+    face_locations = detect_faces_scaled(frame, rgb)
+    # Every detection counts toward the multi-face rule, however small
+    n_faces = len(face_locations)
+    log(f"Detected {n_faces} face(s)")
+    if n_faces != 1:
+        _last_auth_box = None
+        return n_faces, False
+
+    box = face_locations[0]
+    t, r, b, l = box
+    if (r - l) < MIN_FACE_SIZE or (b - t) < MIN_FACE_SIZE:
+        # Too small to encode reliably: count as "no valid face"
+        log(f"Face {r - l}x{b - t} px below MIN_FACE_SIZE; treating as absent")
+        _last_auth_box = None
+        return 0, False
+
+    now = datetime.now()
+    authorized = False
+    if (_last_auth_box is not None
+            and (now - _last_auth_time).total_seconds() < REVERIFY_SECONDS
+            and box_iou(box, _last_auth_box) > REUSE_IOU):
+        # Same face hasn't moved since it was verified: skip the encoder
+        authorized = True
+    elif verify:
+        best = best_distance(known_n, encode_face(rgb, box), known_head)
+        if np.isinf(best):
+            log(f"Best face distance > {ALLOWED_TOLERANCE} (prefiltered)")
+        else:
+            log(f"Best face distance: {best:.3f}")
+        authorized = (best <= ALLOWED_TOLERANCE)
+        if authorized:
+            _last_auth_box, _last_auth_time = box, now
+    if not authorized:
+        _last_auth_box = None
+    return n_faces, authorized
+
+def check_dlib_build():
+    """Log dlib build features; False if it lacks SIMD and REQUIRE_SIMD_DLIB is set."""
+    avx = getattr(dlib, "USE_AVX_INSTRUCTIONS", False)
+    neon = getattr(dlib, "USE_NEON_INSTRUCTIONS", False)
+    cuda = getattr(dlib, "DLIB_USE_CUDA", False)
+    log(f"dlib {dlib.__version__}: AVX={avx} NEON={neon} CUDA={cuda}")
+    if avx or neon:
+        return True
+    log("dlib was built without AVX/NEON; detection and encoding will be very slow. "
+        "Rebuild it (see README 'Performance') or set REQUIRE_SIMD_DLIB = False.")
+    return not REQUIRE_SIMD_DLIB
+
 def main():
+    if not check_dlib_build():
+        sys.exit(1)
+
     # Enrollment
     if not os.path.isdir(ENROLL_DIR):
         log(f"Enrollment dir {ENROLL_DIR} not found. Create it and add photos of your face.")
@@ -136,6 +639,8 @@ def main():
     if known is None or len(known) == 0:
         log("No known face encodings loaded. Exiting.")
         sys.exit(1)
+    known_n = normalize_encodings(known)
+    known_head = prefilter_head(known_n)
 
     # Camera
     cap, cam_idx = open_camera()
@@ -144,32 +649,45 @@ def main():
         sys.exit(1)
     log(f"Opened camera /dev/video{cam_idx} at {FRAME_WIDTH}x{FRAME_HEIGHT}")
 
+    init_yunet()
+    init_cnn_detector()
+    init_dbus_lock()
+    log(f"Face detector: {'YuNet' if _yunet is not None else 'HOG'}")
+
+    grab_thread = start_grabber(cap)
+
     log("Starting presence_guard")
     last_seen_someone = datetime.now()
     frame_i = 0
+    frame_seq = 0
+    next_check = time.perf_counter()
 
     try:
         while True:
+            # Frame arrival paces the loop; CHECK_INTERVAL is only a floor so a
+            # fast camera + fast detector doesn't spin the CPU.
+            delay = next_check - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_check = time.perf_counter() + CHECK_INTERVAL
+
             # optional BT presence
-            if USE_BLUETOOTH and not is_phone_present(PHONE_MAC):
-                log("Phone not present; locking for safety.")
-                lock_session()
-                time.sleep(LOCK_COOLDOWN)
-                continue
+            if USE_BLUETOOTH and not phone_present_cached(PHONE_MAC):
+                lock_with_cooldown("Phone not present")
 
-            frame = latest_frame(cap)
+            frame, frame_seq = latest_frame(frame_seq)
             if frame is None:
+                # never let a stale frame keep reusing the last authorization
+                forget_verified_face()
                 log("Failed to read from webcam, retrying...")
                 time.sleep(CHECK_INTERVAL)
                 continue
 
-            rgb = frame[:, :, ::-1]  # BGR -> RGB (no downscale; already 640x480)
-            rgb = cv2.cvtColor(rgb, cv2.COLOR_BGR2RGB)
-            # Fast face count
-            face_locations = detect_faces_rgb(rgb)
-            n_faces = len(face_locations)
-            log(f"Detected {n_faces} face(s)")
-
+            # Count faces; verify identity of a single face every N frames
+            n_faces, authorized = check_presence(
+                frame, known_n, verify=(frame_i % ENCODING_EVERY_N == 0),
+                known_head=known_head,
+            )
             now = datetime.now()
 
             # Lock immediately if not exactly one face
@@ -178,50 +696,31 @@ def main():
                 # If more than one face, lock immediately.
                 if n_faces == 0:
                     if (now - last_seen_someone).total_seconds() >= ABSENCE_TIMEOUT:
-                        log("No faces for timeout -> locking")
-                        lock_session()
-                        time.sleep(LOCK_COOLDOWN)
+                        lock_with_cooldown("No faces for timeout")
                         # don't update last_seen_someone here; we stay in "absent" state
                     else:
                         log("No face seen yet; waiting for timeout...")
                 else:
-                    log("Multiple faces detected -> locking")
-                    lock_session()
-                    time.sleep(LOCK_COOLDOWN)
-                time.sleep(CHECK_INTERVAL)
+                    lock_with_cooldown("Multiple faces detected")
                 continue
 
-            # Exactly one face: occasionally verify identity (every N frames)
-            authorized = False
-            if frame_i % ENCODING_EVERY_N == 0:
-                encs = face_recognition.face_encodings(rgb, face_locations)
-                if encs:
-                    dists = np.linalg.norm(known - encs[0], axis=1)
-                    best = float(np.min(dists))
-                    log(f"Best face distance: {best:.3f}")
-                    authorized = (best <= ALLOWED_TOLERANCE)
-                else:
-                    log("Could not compute encoding on this frame; treating as unauthorized.")
-
             # Presence & lock decisions
             if authorized:
                 last_seen_someone = now
                 log("Authorized face present — all good.")
             else:
                 # exactly one face but not (yet) authorized: be strict and lock
-                log("Single face not authorized -> locking")
-                lock_session()
-                time.sleep(LOCK_COOLDOWN)
+                lock_with_cooldown("Single face not authorized")
 
             frame_i += 1
-            time.sleep(CHECK_INTERVAL)
 
     except KeyboardInterrupt:
         log("presence_guard stopped by user")
     except Exception as e:
         log(f"presence_guard crashed: {e}")
     finally:
-        cap.release()
+        # the grabber thread releases cap once its current read returns
+        stop_grabber(grab_thread)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file